@@ -45,10 +45,18 @@ learning.
 from __future__ import absolute_import, division, print_function
 
 from abc import ABCMeta, abstractmethod, abstractproperty
+import copy
 import gc
+import hashlib
+import inspect
+import json
+import math
 import os
 import warnings
 
+import numpy as np
+import tensorflow as tf
+
 from tf_keras.callbacks import ModelCheckpoint, EarlyStopping
 from tf_keras.layers import Activation, Layer, LeakyReLU, PReLU, ThresholdedReLU
 from tf_keras.models import Model
@@ -56,9 +64,17 @@ from tf_keras.models import Model
 from tf_keras import backend as K
 from tf_keras.losses import Loss
 from tf_keras.initializers import Constant
+from tf_keras.regularizers import Regularizer
 
 from energyflow.utils import iter_or_rep
 
+# try to import numba, falling back on plain Python for the NumPy twins below
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        return lambda func: func
+
 __all__ = ['ArchBase', 'NNBase']
 
 ###############################################################################
@@ -73,6 +89,9 @@ class ArchBase(object, metaclass=ABCMeta):
     be instantiated directly as it is an abstract base class.
     """
 
+    # {old name: new name} of deprecated hyperparameters
+    _DEPRECATED_HPS = {}
+
     # ArchBase(*args, **kwargs)
     def __init__(self, *args, **kwargs):
         """Accepts arbitrary arguments. Positional arguments (if present) are
@@ -96,28 +115,51 @@ class ArchBase(object, metaclass=ABCMeta):
             self.hps.update(d)
         self.hps.update(kwargs)
 
+        # rename deprecated hyperparameters
+        self._rename_deprecated_hps()
+
         # process hyperparameters
         self._process_hps()
 
         # construct model
         self._construct_model()
 
-    def _proc_arg(self, name, **kwargs):
-        if 'old' in kwargs and kwargs['old'] in self.hps:
-            old = kwargs['old']
-            m = ('\'{}\' is deprecated and will be removed in the future, '
-                 'use \'{}\' instead.').format(old, name)
-            warnings.warn(FutureWarning(m))
-            kwargs['default'] = self.hps.pop(old)
+    def _rename_deprecated_hps(self):
+        """Moves each hyperparameter named in `_DEPRECATED_HPS` to its new
+        name, warning once per deprecated name. A value given under the new
+        name takes precedence.
+        """
+
+        for old, name in self._DEPRECATED_HPS.items():
+            if old in self.hps:
+                m = ('\'{}\' is deprecated and will be removed in the future, '
+                     'use \'{}\' instead.').format(old, name)
+                warnings.warn(m, FutureWarning)
+                self.hps.setdefault(name, self.hps.pop(old))
 
+    def _proc_arg(self, name, **kwargs):
         return (self.hps.pop(name, kwargs['default']) if 'default' in kwargs
                                                       else self.hps.pop(name))
 
+    def _proc_args(self, spec):
+        """Extracts a table of `(name, default)` hyperparameters in a single
+        pass, with the same semantics as `_proc_arg` with a default.
+        """
+
+        hps = {}
+        for name, default in spec:
+            val = self.hps.pop(name, default)
+
+            # avoid sharing mutable defaults between instances
+            hps[name] = copy.copy(val) if val is default else val
+
+        return hps
+
     def _verify_empty_hps(self):
 
         # hps should be all empty now
-        for k in self.hps:
-            raise ValueError('unrecognized keyword argument {}'.format(k))
+        if self.hps:
+            raise ValueError('unrecognized keyword arguments {}'.format(sorted(self.hps)))
 
         del self.hps
 
@@ -200,13 +242,23 @@ class ArchBase(object, metaclass=ABCMeta):
     # pass on unknown attribute lookups to the underlying model
     def __getattr__(self, attr):
 
-        if hasattr(self.model, attr):
-            return getattr(self.model, attr)
+        # single lookup on the model, read from the instance dict so that no
+        # recursion happens while the architecture is still being constructed
+        try:
+            model = self.__dict__['_model']
+            val = getattr(model, attr)
 
-        else:
+        except (KeyError, AttributeError):
             name = self.__class__.__name__
             raise AttributeError("'{}' object has no attribute '{}', ".format(name, attr)
-                                 + "check of underlying model failed")
+                                 + "check of underlying model failed") from None
+
+        # bound methods of the model never change, so store them on the instance
+        # where later lookups find them without coming through here
+        if inspect.ismethod(val) and val.__self__ is model:
+            self.__dict__[attr] = val
+
+        return val
         
 ###############################################################################
 # Thin wrapper implemented using the tf_keras backend
@@ -219,58 +271,169 @@ class DeMixer(Model):
         # Save attributes 
         self.output_dim = output_dim
         self.number_cat = number_cat 
-        self.alpha      = alpha 
 
         # Save inner model 
         self.architecture = architecture
 
+        # Initialize to the inverse softplus of the former softmax fractions of
+        # eye, so that the identity-like starting simplex of the softmax
+        # parameterization is reproduced exactly for any number_cat.
+        # np.eye builds the rectangular identity directly, without a square
+        # intermediate to slice
+        init_exp        = np.exp(np.eye(output_dim, number_cat, dtype='float32'))
+        init_fractions  = np.log(np.expm1(init_exp/init_exp.sum(axis=1, keepdims=True)))
+
+        # The unique edges of the simplex, built once rather than in every
+        # trace of the perimeter loss
+        idx_i, idx_j    = np.triu_indices(number_cat, k=1)
+        self._edge_i    = tf.constant(idx_i, dtype=tf.int32)
+        self._edge_j    = tf.constant(idx_j, dtype=tf.int32)
+
+        # The perimeter loss, whose strength is read through self.alpha
+        self._perimeter = PerimeterRegularizer(alpha, edge_idx=(self._edge_i, self._edge_j))
+
         self.raw_fractions = self.add_weight(
             shape=(output_dim, number_cat),
             #initializer="random_normal",
-            initializer=Constant(K.eye(output_dim)[:, :number_cat]),
+            initializer=Constant(init_fractions),
+            regularizer=self._perimeter,
             trainable=True
         )
 
+    # Strength of the perimeter loss, stored on the regularizer so that the two
+    # cannot disagree. A new value takes effect the next time the training
+    # step is traced, e.g. after recompiling
+    @property
+    def alpha(self):
+        return self._perimeter.alpha
+
+    @alpha.setter
+    def alpha(self, alpha):
+        self._perimeter.alpha = alpha
+
+    # Traced once per instance, so repeated inspection (e.g. from callbacks)
+    # runs a single graph rather than dispatching each op eagerly
+    @tf.function(reduce_retracing=True)
     def getFractions(self):
-        return K.softmax(self.raw_fractions, axis=1)
-    
+        '''
+        The softplus weights normalized over categories, i.e. row k is how
+        output k is shared out among the categories. The vertices are the same
+        weights normalized over outputs instead, so unlike with the former
+        softmax parameterization they are not the renormalized transpose of
+        these fractions.
+        '''
+        pos = tf.nn.softplus(self.raw_fractions)
+        return pos/tf.reduce_sum(pos, axis=1, keepdims=True)
+
+    @tf.function(reduce_retracing=True)
     def getVertices(self):
         return to_vertices(self.raw_fractions)
 
-    def call(self, inputs):
+    def call(self, inputs, training=None):
         # Obtain outputs on inner architecture
         # We assume that the output activation function is set to SOFTMAX
-        barycentric = self.architecture(inputs)
-
-        self.add_loss(lambda: self.alpha * perimeterLoss(self.raw_fractions))
-
-        # This is equivalent to tf.matmul when barycentric and vertices are 2D arrays,
-        # which they are in this case
-        vertices        = to_vertices(self.raw_fractions)
-        outputs         = K.dot(barycentric, vertices)
+        barycentric = self.architecture(inputs, training=training)
+
+        # Under a mixed precision policy the architecture computes in float16;
+        # the demixed outputs are kept in the variable dtype (float32), as Keras
+        # advises for outputs
+        return self._demix(tf.cast(barycentric, self.dtype))
+
+    # Inference with the simplex matmul in half precision, which halves the
+    # memory traffic of the demixing stage. Outputs are cast back to the dtype
+    # of the inner architecture
+    @tf.function(reduce_retracing=True)
+    def predictFP16(self, inputs):
+        barycentric = self.architecture(inputs, training=False)
+        v16         = tf.cast(to_vertices(self.raw_fractions), tf.float16)
+        b16         = tf.cast(barycentric, tf.float16)
+
+        return tf.cast(tf.matmul(b16, v16), barycentric.dtype)
+
+    # XLA fuses the demixing stage into a single kernel when called eagerly;
+    # inside the training step it is inlined into Keras' own traced function.
+    # No input signature is pinned, so the stage follows the layer's dtype
+    @tf.function(jit_compile=True)
+    def _demix(self, barycentric):
+        # The perimeter loss is applied through the regularizer on raw_fractions.
+        # Equivalent to tf.matmul(barycentric, to_vertices(self.raw_fractions)), with
+        # the normalization of each vertex folded into the barycentric coordinates
+        # so that the whole stage is a single contraction
+        # raw_fractions is autocast to the compute dtype under mixed precision
+        pos             = tf.cast(tf.nn.softplus(self.raw_fractions), barycentric.dtype)
+        outputs         = tf.einsum('bc,kc->bk', barycentric/tf.reduce_sum(pos, axis=0), pos)
 
         return outputs 
     
 def to_vertices(raw_fractions):
-    # Calculate the vertex matrix 
-    fractions       = K.softmax(raw_fractions, axis=1)
-    raw_vertices    = K.transpose(fractions)
-    denominator     = K.expand_dims(K.sum(raw_vertices, axis=1), axis=-1)
+    # Calculate the vertex matrix from a non-negative parameterization,
+    # normalizing each vertex onto the simplex in a single step
+    raw_vertices    = tf.transpose(tf.nn.softplus(raw_fractions))
+    denominator     = tf.reduce_sum(raw_vertices, axis=1, keepdims=True)
     vertices        = raw_vertices/denominator 
 
     return vertices
 
-def perimeterLoss(raw_fractions):
-    vertices        = to_vertices(raw_fractions)
-
-    A               = K.expand_dims(vertices, axis=0)
-    B               = K.expand_dims(vertices, axis=1)
-    pws_squares     = K.sum(K.square(A - B), axis=-1)
-    pws_distances   = K.sqrt(pws_squares + 1e-9)
-    edge_lengths    = 0.5*K.sum(pws_distances)
+def perimeterLoss(vertices, edge_idx=None):
+    # Enumerate each of the C(C-1)/2 unique edges of the simplex once,
+    # rather than the full CxC pairwise tensor with its degenerate diagonal.
+    # The (idx_i, idx_j) edge indices may be passed in precomputed
+    if edge_idx is None:
+        edge_idx = np.triu_indices(vertices.shape[0], k=1)
+    idx_i, idx_j    = edge_idx
+    edges           = tf.gather(vertices, idx_i) - tf.gather(vertices, idx_j)
+    edge_lengths    = tf.reduce_sum(tf.sqrt(tf.reduce_sum(tf.square(edges), axis=-1) + 1e-9))
 
     return edge_lengths
 
+# NumPy twins of to_vertices and perimeterLoss, for analyzing trained
+# raw_fractions (e.g. from saved checkpoints) without going through TensorFlow
+
+@njit(cache=True)
+def to_vertices_np(raw_fractions):
+    D, C = raw_fractions.shape
+    vertices = np.empty((C, D))
+    for i in range(C):
+        norm = 0.0
+        for k in range(D):
+            # numerically stable softplus
+            x = raw_fractions[k, i]
+            vertices[i, k] = max(x, 0.0) + math.log1p(math.exp(-abs(x)))
+            norm += vertices[i, k]
+        for k in range(D):
+            vertices[i, k] /= norm
+
+    return vertices
+
+@njit(cache=True)
+def perimeterLoss_np(vertices):
+    C, D = vertices.shape
+    s = 0.0
+    for i in range(C):
+        for j in range(i + 1, C):
+            d = 0.0
+            for k in range(D):
+                t = vertices[i, k] - vertices[j, k]
+                d += t*t
+            s += math.sqrt(d + 1e-9)
+
+    return s
+
+class PerimeterRegularizer(Regularizer):
+    '''
+    Penalizes the perimeter of the simplex parameterized by raw_fractions.
+    '''
+
+    def __init__(self, alpha, edge_idx=None):
+        self.alpha = alpha
+        self.edge_idx = edge_idx
+
+    def __call__(self, raw_fractions):
+        return self.alpha * perimeterLoss(to_vertices(raw_fractions), self.edge_idx)
+
+    def get_config(self):
+        return {'alpha': self.alpha}
+
 
 ###############################################################################
 # NNBase
@@ -278,6 +441,41 @@ def perimeterLoss(raw_fractions):
 
 class NNBase(ArchBase):
 
+    # (name, default) for the hyperparameters common to all NN architectures
+    _HP_SPEC = (
+
+        # compilation
+        ('loss', 'categorical_crossentropy'),
+        ('optimizer', 'adam'),
+        ('metrics', ['acc']),
+        ('compile_opts', {}),
+
+        # output
+        ('output_dim', 2),
+        ('output_act', 'softmax'),
+
+        # callbacks
+        ('filepath', None),
+        ('save_while_training', True),
+        ('save_weights_only', False),
+        ('modelcheck_opts', {}),
+        ('patience', None),
+        ('earlystop_opts', {}),
+
+        # flags
+        ('name_layers', True),
+        ('compile', True),
+        ('summary', True),
+
+        # demixer, number_cat defaults to output_dim
+        ('number_cat', None),
+        ('mode', 'demix'),
+        ('alpha', 0.0001),
+    )
+
+    # digests of the configs of the models whose summary has been printed
+    _SUMMARY_PRINTED = set()
+
     def __init__(self, *args, **kwargs):
         '''
         A NNBase object has the additional property that it can be demixed.
@@ -365,14 +563,19 @@ class NNBase(ArchBase):
         - **compile**=`True` : _bool_
             - Whether the model should be compiled or not.
         - **summary**=`True` : _bool_
-            - Whether a summary should be printed or not.
+            - Whether a summary should be printed or not. The summary of a
+            given architecture is only printed the first time it is built
+            in a process, where architectures are compared by the class and
+            configuration of their layers, ignoring layer names.
         """
 
+        hps = self._proc_args(self._HP_SPEC)
+
         # compilation
-        self.compile_opts = {'loss': self._proc_arg('loss', default='categorical_crossentropy'),
-                             'optimizer': self._proc_arg('optimizer', default='adam'),
-                             'metrics': self._proc_arg('metrics', default=['acc'])}
-        self.compile_opts.update(self._proc_arg('compile_opts', default={}))
+        self.compile_opts = {'loss': hps['loss'],
+                             'optimizer': hps['optimizer'],
+                             'metrics': hps['metrics']}
+        self.compile_opts.update(hps['compile_opts'])
 
         # add these attributes for historical reasons
         self.loss = self.compile_opts['loss']
@@ -380,34 +583,36 @@ class NNBase(ArchBase):
         self.metrics = self.compile_opts['metrics']
 
         # output
-        self.output_dim = self._proc_arg('output_dim', default=2)
-        self.output_act = self._proc_arg('output_act', default='softmax')
+        self.output_dim = hps['output_dim']
+        self.output_act = hps['output_act']
 
         # callbacks
-        self.filepath = self._proc_arg('filepath', default=None)
+        self.filepath = hps['filepath']
         if self.filepath is not None:
             self.filepath = os.path.expanduser(self.filepath)
-        self.save_while_training = self._proc_arg('save_while_training', default=True)
+        self.save_while_training = hps['save_while_training']
         self.modelcheck_opts = {'save_best_only': True, 'verbose': 1,
-                'save_weights_only': self._proc_arg('save_weights_only', default=False)}
-        self.modelcheck_opts.update(self._proc_arg('modelcheck_opts', default={}))
+                                'save_weights_only': hps['save_weights_only']}
+        self.modelcheck_opts.update(hps['modelcheck_opts'])
         self.save_weights_only = self.modelcheck_opts['save_weights_only']
 
         self.earlystop_opts = {'restore_best_weights': True, 'verbose': 1,
-                               'patience': self._proc_arg('patience', default=None)}
-        self.earlystop_opts.update(self._proc_arg('earlystop_opts', default={}))
+                               'patience': hps['patience']}
+        self.earlystop_opts.update(hps['earlystop_opts'])
         self.patience = self.earlystop_opts['patience']
 
         # flags
-        self.name_layers = self._proc_arg('name_layers', default=True)
-        self.compile = self._proc_arg('compile', default=True)
-        self.summary = self._proc_arg('summary', default=True)
+        self.name_layers = hps['name_layers']
+        self.compile = hps['compile']
+        self.summary = hps['summary']
 
         # Number of categories (For the demixer)
-        self.number_cat = self._proc_arg('number_cat', default=self.output_dim)
+        self.number_cat = hps['number_cat']
+        if self.number_cat is None:
+            self.number_cat = self.output_dim
         allowed_modes   = {'demix', 'plain'}
-        self.mode       = self._proc_arg('mode', default='demix').lower()
-        self.alpha      = self._proc_arg('alpha', default=0.0001)
+        self.mode       = hps['mode'].lower()
+        self.alpha      = hps['alpha']
 
         if self.mode not in allowed_modes:
             raise ValueError(
@@ -423,18 +628,7 @@ class NNBase(ArchBase):
             pass
 
     def _add_act(self, act):
-
-        # handle case of act as a layer
-        if isinstance(act, Layer):
-            self.model.add(act)
-
-        # handle case of act being a string and in ACT_DICT
-        elif isinstance(act, str) and act in ACT_DICT:
-            self.model.add(ACT_DICT[act]())
-
-        # default case of regular activation
-        else:
-            self.model.add(Activation(act))
+        self.model.add(_get_act_layer(act))
 
     def _proc_name(self, name):
         return name if self.name_layers else None
@@ -445,17 +639,21 @@ class NNBase(ArchBase):
         if self.compile:
             self.model.compile(**self.compile_opts)
 
-            # print summary
+            # print summary, once per distinct architecture so that sweeps
+            # building the same model many times don't repeat it
             if self.summary:
-                self.model.summary()
+                digest = _architecture_digest(self.model)
+                if digest not in NNBase._SUMMARY_PRINTED:
+                    NNBase._SUMMARY_PRINTED.add(digest)
+                    self.model.summary()
 
     def _compile_demixer(self):
         '''
         Instructions to compile the demixer. In the future, might want to add different arguments for the demixer.
         '''
-        # compile model if specified
+        # compile model if specified, with XLA unless the user says otherwise
         if self.compile:
-            self.demixer.compile(**self.compile_opts)
+            self.demixer.compile(**dict({'jit_compile': True}, **self.compile_opts))
 
             # # print summary
             # if self.summary:
@@ -476,6 +674,11 @@ class NNBase(ArchBase):
         else:
             fitTarget = self.model 
 
+        # apply the input pipeline optimizations to a dataset given directly,
+        # NumPy arrays are left to Keras' own input pipeline
+        if len(args) and isinstance(args[0], tf.data.Dataset):
+            args = (_with_dataset_options(args[0]),) + tuple(args[1:])
+
         # list of callback functions
         callbacks = []
 
@@ -487,8 +690,9 @@ class NNBase(ArchBase):
         if self.patience is not None:
             callbacks.append(EarlyStopping(**self.earlystop_opts))
 
-        # update any callbacks that were passed with the two we build in explicitly
-        kwargs.setdefault('callbacks', []).extend(callbacks)
+        # combine any callbacks that were passed with the two we build in explicitly,
+        # in a new list so that the caller's is left untouched
+        kwargs['callbacks'] = list(kwargs.get('callbacks') or []) + callbacks
 
         # do the fitting
         hist = fitTarget.fit(*args, **kwargs)
@@ -500,8 +704,11 @@ class NNBase(ArchBase):
             else:
                 fitTarget.save(self.filepath)
 
-        # take out the trash
-        gc.collect()
+        # take out the trash, only paying for a full collection once enough
+        # young-generation passes have piled up since the last one
+        gc.collect(1)
+        if gc.get_count()[2] >= gc.get_threshold()[2]:
+            gc.collect()
 
         return hist
 
@@ -531,6 +738,45 @@ class NNBase(ArchBase):
             raise AttributeError("'{}' object has no underlying demixer".format(name))
 
 
+###############################################################################
+# Model Summaries
+###############################################################################
+
+def _strip_names(config):
+
+    # drop every name from a (nested) layer config
+    if isinstance(config, dict):
+        return {k: _strip_names(v) for k, v in config.items() if k != 'name'}
+    if isinstance(config, (list, tuple)):
+        return [_strip_names(v) for v in config]
+    return config
+
+def _architecture_digest(model):
+
+    # identify an architecture by the class and config of each of its layers,
+    # in order, ignoring the names Keras generates (model_1, activation_3, ...)
+    layers = [(layer.__class__.__name__, _strip_names(layer.get_config()))
+              for layer in model.layers]
+    config = json.dumps(layers, sort_keys=True, default=str)
+
+    return hashlib.sha1(config.encode()).hexdigest()
+
+###############################################################################
+# Input Pipelines
+###############################################################################
+
+def _with_dataset_options(ds):
+
+    # turn on static optimizations of the input pipeline, leaving any option
+    # the dataset already sets (e.g. explicitly disabling one) as it is
+    current = ds.options().experimental_optimization
+    opts = tf.data.Options()
+    for name in ('map_and_batch_fusion', 'parallel_batch'):
+        if getattr(current, name) is None:
+            setattr(opts.experimental_optimization, name, True)
+
+    return ds.with_options(opts)
+
 ###############################################################################
 # Activation Functions
 ###############################################################################
@@ -543,9 +789,7 @@ def _get_act_layer(act):
     if isinstance(act, Layer):
         return act
 
-    # handle case of act being a string and in ACT_DICT
-    if isinstance(act, str) and act in ACT_DICT:
-        return ACT_DICT[act]()
-
-    # default case of passing act into layer
-    return Activation(act)
+    # handle case of act being a key of ACT_DICT, otherwise pass act into layer.
+    # acts may be unhashable (e.g. a dict config), so only strings are looked up
+    act_class = ACT_DICT.get(act) if isinstance(act, str) else None
+    return Activation(act) if act_class is None else act_class()
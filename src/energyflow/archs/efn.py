@@ -149,6 +149,11 @@ def construct_latent(input_tensor, weight_tensor, dropout=0., name=None):
 
 class SymmetricPerParticleNN(NNBase):
 
+    _DEPRECATED_HPS = {'ppm_sizes': 'Phi_sizes', 'dense_sizes': 'F_sizes',
+                       'ppm_acts': 'Phi_acts', 'dense_acts': 'F_acts',
+                       'ppm_k_inits': 'Phi_k_inits', 'dense_k_inits': 'F_k_inits',
+                       'dense_dropouts': 'F_dropouts'}
+
     # EFN(*args, **kwargs)
     def _process_hps(self):
         r"""See [`ArchBase`](#archbase) for how to pass in hyperparameters as
@@ -229,25 +234,20 @@ class SymmetricPerParticleNN(NNBase):
 
         # required hyperparameters
         self.input_dim = self._proc_arg('input_dim')
-        self.Phi_sizes = self._proc_arg('Phi_sizes', old='ppm_sizes')
-        self.F_sizes = self._proc_arg('F_sizes', old='dense_sizes')
+        self.Phi_sizes = self._proc_arg('Phi_sizes')
+        self.F_sizes = self._proc_arg('F_sizes')
 
         # activations
-        self.Phi_acts = iter_or_rep(self._proc_arg('Phi_acts', default='relu',
-                                                               old='ppm_acts'))
-        self.F_acts = iter_or_rep(self._proc_arg('F_acts', default='relu',
-                                                           old='dense_acts'))
+        self.Phi_acts = iter_or_rep(self._proc_arg('Phi_acts', default='relu'))
+        self.F_acts = iter_or_rep(self._proc_arg('F_acts', default='relu'))
 
         # initializations
-        self.Phi_k_inits = iter_or_rep(self._proc_arg('Phi_k_inits', default='he_uniform',
-                                                                     old='ppm_k_inits'))
-        self.F_k_inits = iter_or_rep(self._proc_arg('F_k_inits', default='he_uniform',
-                                                                 old='dense_k_inits'))
+        self.Phi_k_inits = iter_or_rep(self._proc_arg('Phi_k_inits', default='he_uniform'))
+        self.F_k_inits = iter_or_rep(self._proc_arg('F_k_inits', default='he_uniform'))
 
         # regularizations
         self.latent_dropout = self._proc_arg('latent_dropout', default=0.)
-        self.F_dropouts = iter_or_rep(self._proc_arg('F_dropouts', default=0.,
-                                                                   old='dense_dropouts'))
+        self.F_dropouts = iter_or_rep(self._proc_arg('F_dropouts', default=0.))
         self.Phi_l2_regs = iter_or_rep(self._proc_arg('Phi_l2_regs', default=0.))
         self.F_l2_regs   = iter_or_rep(self._proc_arg('F_l2_regs', default=0.))
 
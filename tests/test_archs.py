@@ -5,8 +5,11 @@ from __future__ import absolute_import, division
 
 import numpy as np
 import pytest
+import tensorflow as tf
 
 from tf_keras import backend as K
+from tf_keras import mixed_precision
+from tf_keras.callbacks import History, LambdaCallback
 from tf_keras.layers import PReLU
 from tf_keras.initializers import Constant
 
@@ -177,3 +180,212 @@ def test_PFN_required(nglobal):
     pfn = archs.PFN(input_dim=3, Phi_sizes=[10], F_sizes=[10], num_global_features=nglobal, summary=False)
     hist = pfn.fit(X_train, Y_train, epochs=1, batch_size=5, validation_data=(X_val, Y_val))
     pfn._global_feature_tensor
+
+@pytest.mark.arch
+@pytest.mark.archbase
+@pytest.mark.parametrize('number_cat', [2, 3, 5])
+@pytest.mark.parametrize('output_dim', [2, 4])
+def test_perimeterLoss(output_dim, number_cat):
+    raw_fractions = np.random.randn(output_dim, number_cat).astype(np.float32)
+    vertices = K.eval(archs.archbase.to_vertices(K.constant(raw_fractions)))
+
+    # brute force sum over each unique edge of the simplex
+    perimeter = sum(np.linalg.norm(vertices[i] - vertices[j])
+                    for i in range(number_cat) for j in range(i + 1, number_cat))
+
+    loss = K.eval(archs.archbase.perimeterLoss(K.constant(vertices)))
+    assert epsilon_percent(loss, perimeter, 10**-4)
+
+@pytest.mark.arch
+@pytest.mark.archbase
+@pytest.mark.parametrize('number_cat', [2, 3])
+def test_DeMixer_simplex(number_cat):
+    n, input_dim, output_dim = 50, 10, 4
+    X_train = np.random.rand(n, input_dim)
+    Y_train = np.random.rand(n, output_dim)
+    dnn = archs.DNN(input_dim=input_dim, dense_sizes=[10], summary=False,
+                    output_dim=output_dim, number_cat=number_cat)
+    dnn.fit(X_train, Y_train, epochs=1, batch_size=10)
+
+    vertices = dnn.demixer.getVertices().numpy()
+    fractions = dnn.demixer.getFractions().numpy()
+    assert vertices.shape == (number_cat, output_dim)
+    assert fractions.shape == (output_dim, number_cat)
+    assert epsilon_diff(vertices.sum(axis=1), 1, 10**-6)
+    assert epsilon_diff(fractions.sum(axis=1), 1, 10**-6)
+
+    # demixed outputs are the barycentric combination of the vertices
+    X_test = np.random.rand(n, input_dim)
+    barycentric = dnn.model.predict(X_test)
+    assert epsilon_diff(dnn.predict(X_test), barycentric @ vertices, 10**-6)
+
+@pytest.mark.arch
+@pytest.mark.archbase
+def test_DeMixer_predictFP16():
+    n, input_dim, output_dim = 50, 10, 4
+    dnn = archs.DNN(input_dim=input_dim, dense_sizes=[10], summary=False,
+                    output_dim=output_dim, number_cat=3)
+
+    X_test = np.random.rand(n, input_dim).astype('float32')
+    preds = dnn.demixer.predictFP16(X_test).numpy()
+    assert preds.dtype == np.float32
+    assert epsilon_diff(preds, dnn.predict(X_test), 10**-2)
+
+@pytest.mark.arch
+@pytest.mark.archbase
+@pytest.mark.parametrize('number_cat', [2, 3])
+def test_DeMixer_numpy_twins(number_cat):
+    dnn = archs.DNN(input_dim=10, dense_sizes=[10], summary=False,
+                    output_dim=4, number_cat=number_cat)
+
+    raw_fractions = dnn.demixer.raw_fractions.numpy().astype(np.float64)
+    vertices = archs.archbase.to_vertices_np(raw_fractions)
+    assert epsilon_diff(vertices, dnn.demixer.getVertices().numpy(), 10**-6)
+
+    perimeter = archs.archbase.perimeterLoss(K.constant(vertices))
+    assert epsilon_diff(archs.archbase.perimeterLoss_np(vertices), K.eval(perimeter), 10**-5)
+
+@pytest.mark.arch
+@pytest.mark.archbase
+@pytest.mark.efn
+def test_EFN_deprecated_hps():
+    with pytest.warns(FutureWarning) as record:
+        efn = archs.EFN(input_dim=2, ppm_sizes=[10, 5], dense_sizes=[8], summary=False)
+
+    messages = [str(w.message) for w in record]
+    assert any('ppm_sizes' in m and 'Phi_sizes' in m for m in messages)
+    assert any('dense_sizes' in m and 'F_sizes' in m for m in messages)
+    assert efn.Phi_sizes == [10, 5]
+    assert efn.F_sizes == [8]
+
+@pytest.mark.arch
+@pytest.mark.archbase
+def test_unrecognized_hps():
+    with pytest.raises(ValueError) as excinfo:
+        archs.DNN(input_dim=10, dense_sizes=[10], summary=False, foo=1, bar=2)
+
+    assert "['bar', 'foo']" in str(excinfo.value)
+
+@pytest.mark.arch
+@pytest.mark.archbase
+def test_fit_callbacks_unchanged():
+    n, input_dim = 50, 10
+    X_train = np.random.rand(n, input_dim)
+    Y_train = np.random.rand(n, 2)
+    X_val = np.random.rand(n//10, input_dim)
+    Y_val = np.random.rand(n//10, 2)
+    dnn = archs.DNN(input_dim=input_dim, dense_sizes=[10], summary=False, patience=1)
+
+    callbacks = [History()]
+    for _ in range(2):
+        dnn.fit(X_train, Y_train, epochs=1, batch_size=10, validation_data=(X_val, Y_val),
+                callbacks=callbacks)
+    assert len(callbacks) == 1 and isinstance(callbacks[0], History)
+
+@pytest.mark.arch
+@pytest.mark.archbase
+def test_DeMixer_mixed_precision():
+    n, input_dim, output_dim = 50, 10, 4
+    X_train = np.random.rand(n, input_dim)
+    Y_train = np.random.rand(n, output_dim)
+
+    mixed_precision.set_global_policy('mixed_float16')
+    try:
+        dnn = archs.DNN(input_dim=input_dim, dense_sizes=[10], summary=False,
+                        output_dim=output_dim, number_cat=3)
+        dnn.fit(X_train, Y_train, epochs=1, batch_size=10)
+        preds = dnn.predict(X_train)
+    finally:
+        mixed_precision.set_global_policy('float32')
+
+    assert preds.dtype == np.float32
+    assert np.all(np.isfinite(preds))
+    assert epsilon_diff(preds.sum(axis=1), 1, 10**-2)
+
+@pytest.mark.arch
+@pytest.mark.archbase
+def test_DeMixer_float64():
+    n, input_dim, output_dim = 50, 10, 4
+    X_train = np.random.rand(n, input_dim)
+    Y_train = np.random.rand(n, output_dim)
+
+    K.set_floatx('float64')
+    try:
+        dnn = archs.DNN(input_dim=input_dim, dense_sizes=[10], summary=False,
+                        output_dim=output_dim, number_cat=3)
+        dnn.fit(X_train, Y_train, epochs=1, batch_size=10)
+        preds = dnn.predict(X_train)
+    finally:
+        K.set_floatx('float32')
+
+    assert preds.dtype == np.float64
+    assert epsilon_diff(preds.sum(axis=1), 1, 10**-10)
+
+@pytest.mark.arch
+@pytest.mark.archbase
+@pytest.mark.pfn
+@pytest.mark.parametrize('batch_size', [7, 10])
+def test_fit_dataset(batch_size):
+    n, m, nglobal = 50, 10, 2
+    X_train = (np.random.rand(n, m, 3), np.random.rand(n, nglobal))
+    Y_train = np.random.rand(n, 2)
+    X_val = [np.random.rand(n//5, m, 3), np.random.rand(n//5, nglobal)]
+    Y_val = np.random.rand(n//5, 2)
+    pfn = archs.PFN(input_dim=3, Phi_sizes=[10], F_sizes=[10], num_global_features=nglobal, summary=False)
+
+    ds = tf.data.Dataset.from_tensor_slices((X_train, Y_train)).batch(batch_size)
+    train_batches = []
+    counter = LambdaCallback(on_train_batch_end=lambda batch, logs: train_batches.append(batch))
+    hist = pfn.fit(ds, epochs=1, validation_data=(X_val, Y_val), callbacks=[counter])
+    assert len(train_batches) == -(-n//batch_size)
+    assert 'val_loss' in hist.history
+
+@pytest.mark.arch
+@pytest.mark.archbase
+def test_fit_dataset_options():
+    ds = tf.data.Dataset.from_tensor_slices((np.random.rand(50, 10), np.random.rand(50, 2))).batch(10)
+
+    opts = tf.data.Options()
+    opts.experimental_optimization.map_and_batch_fusion = False
+    ds = archs.archbase._with_dataset_options(ds.with_options(opts))
+
+    # options set by the caller are kept, unset ones are filled in
+    assert ds.options().experimental_optimization.map_and_batch_fusion is False
+    assert ds.options().experimental_optimization.parallel_batch is True
+
+@pytest.mark.arch
+@pytest.mark.archbase
+@pytest.mark.parametrize('number_cat', [2, 3, 4])
+def test_DeMixer_initial_simplex(number_cat):
+    output_dim = 4
+    dnn = archs.DNN(input_dim=10, dense_sizes=[10], summary=False,
+                    output_dim=output_dim, number_cat=number_cat)
+
+    # starting simplex of the former softmax parameterization
+    fractions = np.exp(np.eye(output_dim, number_cat))
+    fractions /= fractions.sum(axis=1, keepdims=True)
+    vertices = fractions.T/fractions.T.sum(axis=1, keepdims=True)
+
+    assert epsilon_diff(dnn.demixer.getVertices().numpy(), vertices, 10**-6)
+    assert epsilon_diff(dnn.demixer.getFractions().numpy(), fractions, 10**-6)
+
+@pytest.mark.arch
+@pytest.mark.archbase
+def test_summary_printed_once(capsys):
+
+    # an architecture no other test builds, so its first summary is printed
+    archs.DNN(input_dim=13, dense_sizes=[11, 7], acts='sigmoid', output_dim=3)
+    assert 'Total params' in capsys.readouterr().out
+
+    archs.DNN(input_dim=13, dense_sizes=[11, 7], acts='sigmoid', output_dim=3)
+    assert capsys.readouterr().out == ''
+
+@pytest.mark.arch
+@pytest.mark.dnn
+def test_DNN_dict_act():
+    n, input_dim = 50, 10
+    X_train = np.random.rand(n, input_dim)
+    Y_train = np.random.rand(n, 2)
+    dnn = archs.DNN(input_dim=input_dim, dense_sizes=[10, 10], summary=False,
+                    acts={'class_name': 'LeakyReLU', 'config': {'alpha': 0.1}})
+    dnn.fit(X_train, Y_train, epochs=1, batch_size=10)